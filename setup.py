@@ -88,7 +88,8 @@ setup(
     # For an analysis of "install_requires" vs pip's requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=['requests', 'PyYAML', 'Jinja2>=2.10.1',
-                      'pandas', 'plotly<3'],
+                      'pandas', 'plotly<3',
+                      'futures; python_version < "3.0"'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). Users will be able to install these using the "extras"
@@ -98,10 +99,12 @@ setup(
     #
     # Similar to `install_requires` above, these must be valid existing
     # projects.
-    # extras_require={  # Optional
-    #    'dev': ['check-manifest'],
-    #    'test': ['coverage'],
-    # },
+    extras_require={  # Optional
+        # faster parsing of Gerrit/GitHub responses where available
+        'orjson': ['orjson; python_version >= "3.6"'],
+        # --format parquet reports
+        'parquet': ['pyarrow'],
+    },
 
     package_data={
         'zingstats': ['zing_stats.html.j2'],
@@ -0,0 +1,58 @@
+#
+# (c) Copyright 2018,2019 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os.path
+
+import pytest
+import requests
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'data')
+
+
+@pytest.fixture(scope='session')
+def http_session():
+    """One requests session shared by every test that talks to a mock."""
+    session = requests.Session()
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope='session')
+def load_test_data():
+    """Return a loader for files in tests/data that reads each file once."""
+    cache = dict()
+
+    def load(data_file):
+        if data_file not in cache:
+            with open(os.path.join(TEST_DATA_DIR, data_file), 'rb') as f:
+                cache[data_file] = f.read().decode('utf-8')
+        return cache[data_file]
+
+    return load
+
+
+@pytest.fixture(scope='session')
+def nonempty_changes_text(load_test_data):
+    """Raw gerrit response shared by the gather tests, read once."""
+    return load_test_data('test_nonempty_changes.response')
+
+
+@pytest.fixture(scope='session')
+def nonempty_changes_json(nonempty_changes_text):
+    """Decoded form of nonempty_changes_text, parsed once."""
+    return json.loads(nonempty_changes_text[5:])
@@ -15,51 +15,80 @@
 #
 # flake8: noqa
 
+import json
 import logging
-import os.path
+import re
 from datetime import datetime
 from datetime import timedelta
 
+import pytest
 import requests
+import requests_mock
 
+from zingstats.changes import GerritChange
 from zingstats.changes import GerritChanges
 
+FINISH_DT = datetime(2018, 9, 26, 10, 0, 0)
+START_DT = FINISH_DT - timedelta(hours=24)
+MOCKED_CHANGES_URL = 'https://review.openstack.org/changes/?q=status%3Aopen+OR+status%3Aclosed&start=0&o=ALL_REVISIONS&o=MESSAGES&n=100'  # noqa
+
+
+def prep_test_changes(session, **kwargs):
+    url = 'https://review.openstack.org'
+    query = 'status:open OR status:closed'
+    projects = ['openstack/cinder', 'openstack/openstack-ansible-ops',
+                'openstack/networking-calico']
+    branches = ['stable/pike', 'master']
+    # TODO sanitise test file
+    return GerritChanges(url, query, projects, branches,
+                         START_DT, FINISH_DT, session, **kwargs)
+
+
+def load_change_pages(load_test_data):
+    """Return the three single change test pages, decoded."""
+    return [json.loads(load_test_data('test_changes_page%d.response' % n)[5:])
+            for n in (1, 2, 3)]
+
+
+def mock_change_pages(requests_mock, pages):
+    """Serve the decoded pages as gerrit would, keyed by query start."""
+    bodies = [")]}'\n" + json.dumps(page) for page in pages]
+
+    def page_body(request, context):
+        return bodies[int(request.qs['start'][0])]
+
+    requests_mock.get(re.compile(r'/changes/\?'), text=page_body)
+
+
+@pytest.fixture(scope='class')
+def gathered_changes(http_session, nonempty_changes_text):
+    """Changes gathered once from the mocked response, shared by a class."""
+    with requests_mock.Mocker() as m:
+        m.get(MOCKED_CHANGES_URL, text=nonempty_changes_text)
+        changes = prep_test_changes(http_session)
+        changes.gather()
+    return changes
+
 
 # TODO look at betamax for managing test inputs
 class TestClass(object):
-    CHANGES_DATA_FILE = 'test_nonempty_changes.response'
-    MOCKED_CHANGES_URL = 'https://review.openstack.org/changes/?q=status%3Aopen+OR+status%3Aclosed&start=0&o=ALL_REVISIONS&o=MESSAGES&n=100'  # noqa
-
-    def test_changes_empty(self, requests_mock):
+    def test_changes_empty(self, requests_mock, http_session):
         url = 'http://gerrit.example.com/'
         query = 'status:open OR status:closed'
         projects = ['foo/blah']
         branches = ['master']
-        finish_dt = datetime(2018, 9, 26, 10, 0, 0)
-        start_dt = finish_dt - timedelta(hours=24)
 
         requests_mock.get('http://gerrit.example.com/', text='data')
-        session = requests.Session()
         changes = GerritChanges(url, query, projects, branches,
-                                start_dt, finish_dt, session)
+                                START_DT, FINISH_DT, http_session)
         assert len(changes) == 0
 
     # TODO test handling of "_more_changes": true
-    def test_changes_gather(self, requests_mock, caplog):
-        # dumps debug output if the test fails
-        caplog.set_level(logging.DEBUG)
+    def test_changes_gather(self, gathered_changes):
+        assert len(gathered_changes) == 3
 
-        changes = self.prep_test_changes(requests_mock)
-        changes.gather()
-        assert len(changes) == 3
-
-    def test_changes_change(self, requests_mock, caplog):
-        # dumps debug output if the test fails
-        caplog.set_level(logging.DEBUG)
-
-        changes = self.prep_test_changes(requests_mock)
-        changes.gather()
-        change = list(changes)[0]
+    def test_changes_change(self, gathered_changes):
+        change = next(iter(gathered_changes))
         assert change.parent_url == 'https://review.openstack.org'
         assert change.long_id == 'openstack%2Fcinder~stable%2Fpike~Id5dd71a785c4cd72ba44f9b4d26319be53079c39'  # noqa
         assert change.change_id == 'Id5dd71a785c4cd72ba44f9b4d26319be53079c39'
@@ -74,14 +103,9 @@ class TestClass(object):
         assert change.review_url == 'https://review.openstack.org/604103'
         assert change.rev_count() == 1
 
-    def test_changes_change_revision(self, requests_mock, caplog):
-        # dumps debug output if the test fails
-        caplog.set_level(logging.DEBUG)
-
-        changes = self.prep_test_changes(requests_mock)
-        changes.gather()
-        change = list(changes)[0]
-        revision = list(change.revisions())[0]
+    def test_changes_change_revision(self, gathered_changes):
+        change = next(iter(gathered_changes))
+        revision = next(change.revisions())
 
         assert revision.url == 'https://review.openstack.org/changes/openstack%2Fcinder~stable%2Fpike~Id5dd71a785c4cd72ba44f9b4d26319be53079c39/revisions/a5e86c387e67650451d957c5ef525b452203c2fd'  # noqa
         assert revision.number == 1
@@ -89,81 +113,94 @@ class TestClass(object):
         messages = list(revision.messages())
         assert len(messages) == 29
 
-    def test_changes_change_revision_message(self, requests_mock, caplog):
-        # dumps debug output if the test fails
-        # caplog.set_level(logging.DEBUG)
+    def test_changes_change_revision_message(self, gathered_changes):
+        change = next(iter(gathered_changes))
+        revision = next(change.revisions())
+        message = next(revision.messages())
 
-        changes = self.prep_test_changes(requests_mock)
-        changes.gather()
-        change = list(changes)[0]
-        revision = list(change.revisions())[0]
-        messages = list(revision.messages())
-
-        assert messages[0].message_id == '3f79a3b5_0fd64428'
-        assert messages[0].text == 'Patch Set 1: Cherry Picked from branch master.'  # noqa
+        assert message.message_id == '3f79a3b5_0fd64428'
+        assert message.text == 'Patch Set 1: Cherry Picked from branch master.'  # noqa
 
-    def prep_test_changes(self, requests_mock):
-        url = 'https://review.openstack.org'
-        query = 'status:open OR status:closed'
-        projects = ['openstack/cinder', 'openstack/openstack-ansible-ops',
-                    'openstack/networking-calico']
-        branches = ['stable/pike', 'master']
-        finish_dt = datetime(2018, 9, 26, 10, 0, 0)
-        start_dt = finish_dt - timedelta(hours=24)
-        # TODO move data loading out of test case
-        # TODO sanitise test file
-        session = requests.Session()
-        test_data = self.__class__.load_test_changes_data(
-            self.__class__.CHANGES_DATA_FILE)
-        requests_mock.get(self.__class__.MOCKED_CHANGES_URL, text=test_data)
-        changes = GerritChanges(url, query, projects, branches,
-                                start_dt, finish_dt, session)
-        return changes
+    def test_changes_add_results(self, http_session, nonempty_changes_json):
+        changes = prep_test_changes(http_session)
+        assert not changes.add_results(nonempty_changes_json)
+        assert len(changes) == 3
 
-    def test_changes_gather_multipage(self, requests_mock, caplog):
+    def test_changes_add_results_more_changes(self, http_session,
+                                              load_test_data,
+                                              nonempty_changes_json):
+        page = json.loads(load_test_data('test_changes_page1.response')[5:])
+        changes = prep_test_changes(http_session)
+        assert changes.add_results(page)
+        changes = prep_test_changes(http_session, max_changes=1)
+        assert not changes.add_results(nonempty_changes_json)
+        assert len(changes) == 1
+
+    def test_changes_gather_multipage(self, requests_mock, caplog,
+                                      http_session, load_test_data):
         # dumps debug output if the test fails
         caplog.set_level(logging.DEBUG)
 
-        url = 'https://review.openstack.org'
-        query = 'status:open OR status:closed'
-        projects = ['openstack/cinder', 'openstack/openstack-ansible-ops',
-                    'openstack/networking-calico']
-        branches = ['stable/pike', 'master']
-        finish_dt = datetime(2018, 9, 26, 10, 0, 0)
-        start_dt = finish_dt - timedelta(hours=24)
-
-        session = requests.Session()
-
-        test_data_page1 = 'test_changes_page1.response'
-        mocked_url_1 = 'https://review.openstack.org/changes/?q=status%3Aopen+OR+status%3Aclosed&start=0&o=ALL_REVISIONS&o=MESSAGES&n=1'  # noqa
-        test_data1 = self.__class__.load_test_changes_data(test_data_page1)
-        requests_mock.get(mocked_url_1, text=test_data1)
-
-        test_data_page2 = 'test_changes_page2.response'
-        mocked_url_2 = 'https://review.openstack.org/changes/?q=status%3Aopen+OR+status%3Aclosed&start=1&o=ALL_REVISIONS&o=MESSAGES&n=1'  # noqa
-        test_data2 = self.__class__.load_test_changes_data(test_data_page2)
-        requests_mock.get(mocked_url_2, text=test_data2)
-
-        test_data_page3 = 'test_changes_page3.response'
-        mocked_url_3 = 'https://review.openstack.org/changes/?q=status%3Aopen+OR+status%3Aclosed&start=2&o=ALL_REVISIONS&o=MESSAGES&n=1'  # noqa
-        test_data3 = self.__class__.load_test_changes_data(test_data_page3)
-        requests_mock.get(mocked_url_3, text=test_data3)
+        mock_change_pages(requests_mock, load_change_pages(load_test_data))
 
-        changes = GerritChanges(url, query, projects, branches,
-                                start_dt, finish_dt, session, query_size=1)
+        changes = prep_test_changes(http_session, query_size=1)
         changes.gather()
         assert len(changes) == 3
+        assert requests_mock.call_count == 3
 
+    def test_changes_gather_stops_at_start_dt(self, requests_mock,
+                                              http_session, load_test_data):
+        pages = load_change_pages(load_test_data)
+        # gerrit still has more changes, but the second page ends older
+        # than the report so the third page must never be queried
+        pages[1][-1]['updated'] = '2018-09-20 16:24:13.000000000'
+        mock_change_pages(requests_mock, pages)
 
+        changes = prep_test_changes(http_session, query_size=1)
+        changes.gather()
+        assert len(changes) == 1
+        assert requests_mock.call_count == 2
+
+    def test_changes_gather_after_skipped_cutoff(self, requests_mock,
+                                                 http_session,
+                                                 load_test_data):
+        pages = load_change_pages(load_test_data)
+        # the second page ends older than the report, so it is not
+        # prefetched past, but that change is for another project and does
+        # not end the gathering, the third page is queried once it is parsed
+        pages[1][-1]['updated'] = '2018-09-20 16:24:13.000000000'
+        pages[1][-1]['project'] = 'openstack/nova'
+        mock_change_pages(requests_mock, pages)
+
+        changes = prep_test_changes(http_session, query_size=1)
+        changes.gather()
+        assert len(changes) == 2
+        assert requests_mock.call_count == 3
 
+    def test_changes_gather_stops_at_max_changes(self, requests_mock,
+                                                 http_session,
+                                                 load_test_data):
+        mock_change_pages(requests_mock, load_change_pages(load_test_data))
 
-
-    @staticmethod
-    def load_test_changes_data(data_file):
-        test_data_path = os.path.join('tests', 'data', data_file)
-        with open(test_data_path, 'r') as f:
-            test_data = f.read()
-        return test_data
+        changes = prep_test_changes(http_session, query_size=1,
+                                    max_changes=2)
+        changes.gather()
+        assert len(changes) == 2
+        assert requests_mock.call_count == 2
+
+    @pytest.mark.parametrize('gerrit_ts', [
+        '2018-09-25 21:25:19.000000',
+        '2018-09-25 21:25:19.123456',
+        # not the usual shape, handled by the strptime fallback
+        '2018-09-25 21:25:19.1',
+    ])
+    def test_change_ts_to_dt(self, gerrit_ts):
+        assert GerritChange.ts_to_dt(gerrit_ts) == datetime.strptime(
+            gerrit_ts, GerritChange.GERRIT_FORMAT)
+
+    def test_change_ts_to_dt_nanoseconds(self):
+        assert GerritChange.ts_to_dt('2018-09-25 21:25:19.123456789') == \
+            datetime(2018, 9, 25, 21, 25, 19, 123456)
 
     def test_fixture(self, requests_mock):
         requests_mock.get('http://gerrit.example.com/', text='data')
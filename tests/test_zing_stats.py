@@ -0,0 +1,186 @@
+#
+# (c) Copyright 2019 Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# flake8: noqa
+
+import argparse
+import json
+from datetime import datetime
+from datetime import timedelta
+
+import pandas as pd
+import plotly.offline
+import pytest
+
+from zingstats.zing_stats import CIStats
+from zingstats.zing_stats import generate_json
+from zingstats.zing_stats import generate_parquet
+from zingstats.zing_stats import generate_plot
+from zingstats.zing_stats import get_plotlyjs_version
+from zingstats.zing_stats import parse_change_stats
+from zingstats.zing_stats import PLOT_COLUMNS
+from zingstats.zing_stats import prefetch_github_comments
+from zingstats.zing_stats import project_dataframe
+from zingstats.zing_stats import write_file
+
+FINISH_DT = datetime(2018, 9, 26, 10, 0, 0)
+START_DT = FINISH_DT - timedelta(hours=24)
+PLOT_ARGS = argparse.Namespace(range_hours=24, report_format='json')
+
+GITHUB_URL = 'https://github.example.com'
+COMMENTS_URL = GITHUB_URL + '/api/v3/repos/foo/blah/issues/comments'
+ISSUE_URL = GITHUB_URL + '/api/v3/repos/foo/blah/issues/%d'
+
+
+def make_comment(comment_id, number):
+    return {'id': comment_id, 'issue_url': ISSUE_URL % number,
+            'body': 'comment %d' % comment_id}
+
+
+def record_events(args, change, start_dt, stats):
+    """Change parser that counts the events listed on a fake change."""
+    stats.activity.extend(change.get('activity', []))
+    stats.revisions.update(change.get('revisions', {}))
+    stats.lifespan_sec.update(change.get('lifespan_sec', {}))
+
+
+def project_frames(changes, ci_stats, project='foo/blah'):
+    """Return the report frames for one project's fake changes."""
+    df = dict()
+    project_dataframe(df, parse_change_stats(None, changes, START_DT,
+                                             record_events),
+                      ci_stats.dataframe(), project)
+    return df
+
+
+class TestClass(object):
+    def test_prefetch_github_comments(self, requests_mock, http_session):
+        args = argparse.Namespace(github_url=GITHUB_URL, github_token=None,
+                                  verify_https_requests=False)
+        next_url = COMMENTS_URL + '?page=2'
+        requests_mock.get(
+            COMMENTS_URL,
+            text=json.dumps([make_comment(1, 7), make_comment(2, 12)]),
+            headers={'Link': '<%s>; rel="next"' % next_url})
+        requests_mock.get(
+            next_url,
+            text=json.dumps([make_comment(3, 7)]))
+
+        comments = prefetch_github_comments(args, 'foo/blah',
+                                            '2018-09-25T10:00:00Z',
+                                            http_session)
+
+        assert requests_mock.call_count == 2
+        assert requests_mock.request_history[0].qs['per_page'] == ['100']
+        assert sorted(comments) == [7, 12]
+        assert [c['id'] for c in comments[7]] == [1, 3]
+        assert [c['id'] for c in comments[12]] == [2]
+
+    def test_get_plotlyjs_version(self, monkeypatch):
+        bundle = '/**\n* plotly.js v1.31.2\n* Copyright 2012-2017, Plotly, Inc.'
+        monkeypatch.setattr(plotly.offline, 'get_plotlyjs', lambda: bundle)
+        assert get_plotlyjs_version() == '1.31.2'
+
+    def test_get_plotlyjs_version_unknown(self, monkeypatch):
+        monkeypatch.setattr(plotly.offline, 'get_plotlyjs', lambda: '')
+        assert get_plotlyjs_version() == 'latest'
+
+    def test_write_parquet_report(self, tmpdir):
+        pytest.importorskip('pyarrow')
+        args = argparse.Namespace(output_dir=str(tmpdir),
+                                  report_format='parquet', range_hours=24)
+        created = START_DT + timedelta(hours=1)
+        df = project_frames({1: {'activity': [(created, 'created')]},
+                             2: {'activity': [(created, 'created')]}},
+                            CIStats())
+
+        report = generate_parquet(args, df, 2, START_DT, FINISH_DT,
+                                  ['foo/blah'], {}, [], 'All', ['All'])
+        write_file(args, 'last_24h', report, 'All')
+
+        written = pd.read_parquet(str(tmpdir.join('last_24h',
+                                                  'index.parquet')))
+        assert list(written.columns) == list(report.columns)
+        assert written['created'].sum() == 2
+
+    def test_parse_change_stats(self):
+        created = START_DT + timedelta(hours=1)
+        merged = START_DT + timedelta(hours=2)
+        changes = {
+            1: {'activity': [(created, 'created'), (merged, 'merged'),
+                             (merged, 'recheck'), (merged, 'recheck')],
+                'revisions': {merged: 3}, 'lifespan_sec': {merged: 3600.0}},
+            2: {'activity': [(created, 'created'), (created, 'updated')]},
+        }
+        df = parse_change_stats(None, changes, START_DT, record_events)
+
+        assert list(df.columns) == ['created', 'updated', 'merged',
+                                    'revisions', 'lifespan_sec', 'recheck',
+                                    'reverify']
+        assert len(df) == 2
+        created_row = df.loc[pd.Timestamp(created, tz='UTC')]
+        assert created_row['created'] == 2
+        assert created_row['updated'] == 1
+        assert created_row['merged'] == 0
+        merged_row = df.loc[pd.Timestamp(merged, tz='UTC')]
+        assert merged_row['merged'] == 1
+        assert merged_row['recheck'] == 2
+        assert merged_row['revisions'] == 3
+        assert merged_row['lifespan_sec'] == 3600.0
+
+    def test_generate_plot_fills_empty_buckets(self):
+        first = START_DT + timedelta(minutes=90)
+        last = START_DT + timedelta(minutes=270)
+        df = project_frames({1: {'activity': [(first, 'created')]},
+                             2: {'activity': [(last, 'created')]}},
+                            CIStats())
+
+        df_plot = generate_plot(PLOT_ARGS, df, ['foo/blah'], START_DT)
+
+        assert list(df_plot.index) == list(pd.date_range(
+            START_DT + timedelta(hours=1), periods=4, freq='1H'))
+        assert list(df_plot['created']) == [1, 0, 0, 1]
+        assert list(df_plot['ci_success']) == [0, 0, 0, 0]
+
+    def test_generate_plot_pct_without_ci_runs(self):
+        ci_ts = START_DT + timedelta(minutes=90)
+        created = START_DT + timedelta(minutes=150)
+        ci_stats = CIStats()
+        ci_stats.ci_success[ci_stats.slot(ci_ts)] += 3
+        ci_stats.ci_failure[ci_stats.slot(ci_ts)] += 1
+        df = project_frames({1: {'activity': [(created, 'created')]}},
+                            ci_stats)
+
+        df_plot = generate_plot(PLOT_ARGS, df, ['foo/blah'], START_DT)
+
+        assert not df_plot[['pct_success', 'pct_failure']].isnull().values.any()
+        assert list(df_plot['pct_success']) == [75.0, 0.0]
+        assert list(df_plot['pct_failure']) == [25.0, 0.0]
+
+    def test_generate_json_empty_project(self):
+        empty_stats = parse_change_stats(None, {}, START_DT, record_events)
+        assert (empty_stats.dtypes == 'float64').all()
+        assert (CIStats().dataframe().dtypes == 'float64').all()
+        df = project_frames({}, CIStats())
+
+        report = json.loads(generate_json(PLOT_ARGS, df, 0, START_DT,
+                                          FINISH_DT, ['foo/blah'], {}, [],
+                                          'All', ['All']))
+
+        fields = [(field['name'], field['type'])
+                  for field in report['schema']['fields']
+                  if field['name'] in PLOT_COLUMNS]
+        assert report['data'] == []
+        assert fields == [(column, 'number') for column in PLOT_COLUMNS]
@@ -15,11 +15,13 @@
 #
 
 import base64
-import json
 import logging
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import zingstats.util
+
 log = logging.getLogger(__name__)
 
 
@@ -53,8 +55,7 @@ class Changes(object):
     @staticmethod
     def pretty_json(json_data):
         """Pretty print JSON data, usually for logging purposes."""
-        return json.dumps(json_data, sort_keys=True, indent=4,
-                          separators=(',', ': '))
+        return zingstats.util.pretty_json(json_data)
 
 
 class GerritChanges(Changes):
@@ -76,69 +77,110 @@ class GerritChanges(Changes):
                  ', '.join(sorted(self.projects)),
                  branch_list)
 
-        results = [{'_more_changes': True}]
-        while results[-1].get('_more_changes'):
-            log.debug('Querying %d changes starting at %d', self.query_size,
-                      self.query_start)
-            payload = {
-                'q': self.query,
-                # TODO make ALL_FILES gathering toggleable, it is expensive
-                # 'o': ['ALL_REVISIONS', 'MESSAGES', 'ALL_FILES'],
-                'o': ['ALL_REVISIONS', 'MESSAGES'],
-                'start': self.query_start,
-                'n': self.query_size}
-            query = ('%s/changes/' % self.url)
-            response = self.session.get(query, params=payload)
-            log.debug(response.url)
-
-            results = GerritChanges.clean_gerrit_response(response)
-            log.debug(GerritChanges.pretty_json(results))
-            for change_json in results:
-                log.debug(GerritChanges.pretty_json(change_json))
-                log.debug('%d changes (start: %d, count=%d)', len(results),
-                          self.query_start, self.query_size)
-                change = GerritChange(change_json, self.url, self.session)
-
-                if self.projects and change.project not in self.projects:
-                    log.debug('Change %s project %s not in projects, skipping',
-                              change.long_id, change.project)
-                    continue
-
-                if self.branches and change.branch not in self.branches:
-                    log.debug('Change %s branch %s not in branches, skipping',
-                              change.long_id, change.branch)
-                    continue
-
-                if change.long_id in self.changes:
-                    log.warn('Change id %s already stored, not storing again',
-                             change.long_id)
-                    log.warn('cause of this duplicate must be investigated')
-                    continue
-
-                if self.max_changes and len(self.changes) >= self.max_changes:
-                    log.warn('max changes set to %d, not storing more changes',
-                             self.max_changes)
-                    results[-1].pop('_more_changes', None)
-                    break
-
-                if change.updated_dt < self.start_dt:
-                    log.debug('%s is older than %s start, not reading more',
-                              change.updated_dt, self.start_dt)
-                    results[-1].pop('_more_changes', None)
-                    break
-
-                log.debug('Adding change %s (project: %s, branch: %s',
-                          change.long_id, change.project, change.branch)
-                self.add(change)
-
-            self.query_start += self.query_size
+        # fetch the next page while the current one is being parsed into
+        # changes, but only when it is certain to be needed
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = executor.submit(self.query_page, self.query_start)
+            while page is not None:
+                results = page.result()
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(GerritChanges.pretty_json(results))
+                if self.needs_next_page(results):
+                    page = executor.submit(self.query_page,
+                                           self.query_start + self.query_size)
+                else:
+                    page = None
+
+                more_changes = self.add_results(results)
+                self.query_start += self.query_size
+                if more_changes and page is None:
+                    # the cutoff change was for another project or branch
+                    page = executor.submit(self.query_page, self.query_start)
 
         return True
 
+    def needs_next_page(self, results):
+        """Return True if the page after results will certainly be added.
+
+        Changes come newest first, so a page ending in a change older than
+        start_dt is the last one needed, as is a page that could take the
+        changes up to max_changes.
+        """
+        if not results or not results[-1].get('_more_changes'):
+            return False
+        if self.max_changes and \
+                len(self.changes) + len(results) >= self.max_changes:
+            return False
+        return GerritChange.ts_to_dt(results[-1]['updated']) >= self.start_dt
+
+    def query_page(self, query_start):
+        """Query one page of changes starting at query_start."""
+        log.debug('Querying %d changes starting at %d', self.query_size,
+                  query_start)
+        payload = {
+            'q': self.query,
+            # TODO make ALL_FILES gathering toggleable, it is expensive
+            # 'o': ['ALL_REVISIONS', 'MESSAGES', 'ALL_FILES'],
+            'o': ['ALL_REVISIONS', 'MESSAGES'],
+            'start': query_start,
+            'n': self.query_size}
+        query = ('%s/changes/' % self.url)
+        response = self.session.get(query, params=payload)
+        log.debug(response.url)
+        return GerritChanges.clean_gerrit_response(response)
+
+    def add_results(self, results):
+        """Add the changes from a decoded gerrit changes query response.
+
+        Returns True if gerrit has more changes that should be queried.
+        """
+        log.debug('%d changes (start: %d, count=%d)', len(results),
+                  self.query_start, self.query_size)
+        for change_json in results:
+            change = GerritChange(change_json, self.url, self.session)
+
+            if self.projects and change.project not in self.projects:
+                log.debug('Change %s project %s not in projects, skipping',
+                          change.long_id, change.project)
+                continue
+
+            if self.branches and change.branch not in self.branches:
+                log.debug('Change %s branch %s not in branches, skipping',
+                          change.long_id, change.branch)
+                continue
+
+            if change.long_id in self.changes:
+                log.warn('Change id %s already stored, not storing again',
+                         change.long_id)
+                log.warn('cause of this duplicate must be investigated')
+                continue
+
+            if self.max_changes and len(self.changes) >= self.max_changes:
+                log.warn('max changes set to %d, not storing more changes',
+                         self.max_changes)
+                return False
+
+            if change.updated_dt < self.start_dt:
+                log.debug('%s is older than %s start, not reading more',
+                          change.updated_dt, self.start_dt)
+                return False
+
+            log.debug('Adding change %s (project: %s, branch: %s',
+                      change.long_id, change.project, change.branch)
+            self.add(change)
+
+        if self.max_changes and len(self.changes) >= self.max_changes:
+            log.debug('max changes (%d) reached, not querying more',
+                      self.max_changes)
+            return False
+        return bool(results and results[-1].get('_more_changes'))
+
     @staticmethod
     def clean_gerrit_response(response):
         """Strip magic junk off the start of the gerrit response."""
-        return json.loads(response.text[5:])
+        # slice the raw bytes, decoding the whole body to text first only
+        # to throw it away again costs a full copy of every page
+        return zingstats.util.json_loads(response.content[5:])
 
 
 class Change(object):
@@ -177,10 +219,10 @@ class GerritChange(Change):
         self.project = change['project']
         self.branch = change['branch']
         self.status = change['status']
-        self.created_dt = GerritChange.ts_to_dt(change['created'][:-3])
-        self.updated_dt = GerritChange.ts_to_dt(change['updated'][:-3])
+        self.created_dt = GerritChange.ts_to_dt(change['created'])
+        self.updated_dt = GerritChange.ts_to_dt(change['updated'])
         if 'submitted' in change:
-            self.merged_dt = GerritChange.ts_to_dt(change['submitted'][:-3])
+            self.merged_dt = GerritChange.ts_to_dt(change['submitted'])
         self.url = '%s/changes/%s' % (parent_url, self.long_id)
         self.review_url = '%s/%s' % (parent_url, self.number)
 
@@ -204,7 +246,15 @@ class GerritChange(Change):
     @staticmethod
     def ts_to_dt(gerrit_ts):
         """Convert Gerrit format timestamp to datetime."""
-        return datetime.strptime(gerrit_ts, GerritChange.GERRIT_FORMAT)
+        # strptime is slow, build the datetime from the fixed positions of
+        # YYYY-MM-DD HH:MM:SS.ffffff and only fall back for other shapes,
+        # gerrit's own nanosecond timestamps are truncated to microseconds
+        if len(gerrit_ts) not in (26, 29):
+            return datetime.strptime(gerrit_ts, GerritChange.GERRIT_FORMAT)
+        return datetime(int(gerrit_ts[0:4]), int(gerrit_ts[5:7]),
+                        int(gerrit_ts[8:10]), int(gerrit_ts[11:13]),
+                        int(gerrit_ts[14:16]), int(gerrit_ts[17:19]),
+                        int(gerrit_ts[20:26]))
 
 
 class Revision(object):
@@ -235,7 +285,7 @@ class GerritRevision(Revision):
     def __init__(self, revision_id, revision, url, session):
         super(GerritRevision, self).__init__(revision_id, url, session)
         self.number = revision['_number']
-        self.created_dt = GerritChange.ts_to_dt(revision['created'][:-3])
+        self.created_dt = GerritChange.ts_to_dt(revision['created'])
 
         # TODO make ALL_FILES gathering toggleable, it is expensive/slow
         for file_name in revision.get('files', list()):
@@ -247,7 +297,8 @@ class GerritRevision(Revision):
             log.debug(response.url)
             # https://gerrit-review.googlesource.com/Documentation/rest-api-changes.html#diff-info
             diff = GerritChanges.clean_gerrit_response(response)
-            log.debug(GerritChanges.pretty_json(diff))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(GerritChanges.pretty_json(diff))
             self._files[file_name]['diff'] = diff
 
             content_url = '%s/content' % file_url
@@ -269,4 +320,4 @@ class Message(object):
 class GerritMessage(Message):
     def __init__(self, message_id, message_date, message_text):
         super(GerritMessage, self).__init__(message_id, message_text)
-        self.message_dt = GerritChange.ts_to_dt(message_date[:-3])
+        self.message_dt = GerritChange.ts_to_dt(message_date)
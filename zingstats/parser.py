@@ -14,12 +14,21 @@
 # limitations under the License.
 #
 
-import itertools
 import logging
 import re
 
 log = logging.getLogger(__name__)
 
+# TODO refactor to take a list of patterns for runs/jobs from a file
+CI_RUN_GERRIT_RE = re.compile('Patch Set (?P<num>\d+): Verified(?P<v_score>\S+)\s+Build (?P<status>\S+)\s+(?P<jobs>.+)', re.MULTILINE | re.DOTALL)  # noqa
+CI_RUN_PR_RE = re.compile('Build (?P<status>\S+)\s+(?P<jobs>.+)', re.MULTILINE | re.DOTALL)  # noqa
+# both job line formats in one pattern so the jobs are found in one scan,
+# jenkins style links (.../job/<name>/<build>/) or log links (.../<name>)
+CI_JOB_RE = re.compile('^- (?P<proto>.+)?://(?:(?P<jenkins_path>.+)?/job/(?P<name>\S+)/\d+/|(?P<logs_path>.+)?/(?P<logs_name>\D+)) : (?P<result>\S+) in (?:(?P<time_h>\d+)h )?(?:(?P<time_m>\d+)m )?(?P<time_s>\d+)s(?P<non_voting> \(non\-voting\))?(?P<the_rest>.*)$', re.MULTILINE)  # noqa
+
+PROMOTION_SUCCESS_RE = re.compile('(Patch Set \d+:\n\n)?Promotion review .+ has brought into alpha channel')  # noqa
+PROMOTION_FAILURE_RE = re.compile('(Patch Set \d+:\n\n)?PROMOTION FAILURE\n\nPromotion of artifacts from this change into Alpha channel has failed')  # noqa
+
 
 def parse_ci_job_comments(msg):
     """
@@ -28,9 +37,11 @@ def parse_ci_job_comments(msg):
     """
     log.debug('Parsing %s', msg)
 
-    ci_run_patt = 'Patch Set (?P<num>\d+): Verified(?P<v_score>\S+)\s+Build (?P<status>\S+)\s+(?P<jobs>.+)'  # noqa
-
-    return __parse_change_messages(msg.text, ci_run_patt)
+    # most messages are not from CI, skip the regexes for anything that
+    # CI_RUN_GERRIT_RE could never match
+    if not msg.text.startswith('Patch Set '):
+        return dict()
+    return __parse_change_messages(msg.text, CI_RUN_GERRIT_RE)
 
 
 def parse_pr_message(msg):
@@ -38,25 +49,31 @@ def parse_pr_message(msg):
     Parse PR messages that look like CI job messages,
     extracting CI job data and returning as a dict
     """
-    ci_run_patt = 'Build (?P<status>\S+)\s+(?P<jobs>.+)'  # noqa
+    # as above, CI_RUN_PR_RE only matches at the start of the body
+    if not msg['body'].startswith('Build '):
+        return dict()
+    return __parse_change_messages(msg['body'], CI_RUN_PR_RE)
+
 
-    return __parse_change_messages(msg['body'], ci_run_patt)
+# CI bots post many identical messages, keep the parsed result for each
+# (message, run pattern) rather than running the job regexes again
+PARSED_RUNS_MAX = 65536
+_parsed_runs = dict()
 
 
 # TODO Should you do the initial matching in the caller and pass the resulting
 # matcher object and initial dict down to this method?
-def __parse_change_messages(message, ci_run_patt):
+def __parse_change_messages(message, ci_run_re):
     """
     Parse change messages that look like CI job messages,
     extracting CI job data and returning as a dict
-    """
 
-    # TODO refactor to take a list of patterns for runs/jobs from a file
-    ci_run_re = re.compile(ci_run_patt, re.MULTILINE | re.DOTALL)
-    ci_job_v1_patt = '^- (?P<proto>.+)?://(?P<jenkins_path>.+)?/job/(?P<name>\S+)/\d+/ : (?P<result>\S+) in (?P<time_h>\d+h )?(?P<time_m>\d+m )?(?P<time_s>\d+s)(?P<non_voting> \(non\-voting\))?(?P<the_rest>.*)$'  # noqa
-    ci_job_v1_re = re.compile(ci_job_v1_patt, re.MULTILINE)
-    ci_job_v2_patt = '^- (?P<proto>.+)?://(?P<logs_path>.+)?/(?P<name>\D+) : (?P<result>\S+) in (?P<time_h>\d+h )?(?P<time_m>\d+m )?(?P<time_s>\d+s)(?P<non_voting> \(non\-voting\))?(?P<the_rest>.*)$'  # noqa
-    ci_job_v2_re = re.compile(ci_job_v2_patt, re.MULTILINE)
+    Results are cached and shared between callers so must not be modified.
+    """
+    key = (message, ci_run_re.pattern)
+    run = _parsed_runs.get(key)
+    if run is not None:
+        return run
 
     run = dict()
     ci_run_match = ci_run_re.match(message)
@@ -74,44 +91,34 @@ def __parse_change_messages(message, ci_run_patt):
         run['status'] = ci_run_match.group('status')
 
         run['jobs'] = list()
-        for ci_job_match in itertools.chain(
-                ci_job_v1_re.finditer(ci_run_match.group('jobs')),
-                ci_job_v2_re.finditer(ci_run_match.group('jobs'))):
+        for ci_job_match in CI_JOB_RE.finditer(ci_run_match.group('jobs')):
             job = dict()
-            job['name'] = ci_job_match.group('name')
+            job['name'] = (ci_job_match.group('name') or
+                           ci_job_match.group('logs_name'))
             job['result'] = ci_job_match.group('result')
 
-            # mash time fields together into total seconds for job
-            job['total_sec'] = 0
-            ci_job_time_h = ci_job_match.group('time_h')
-            ci_job_time_m = ci_job_match.group('time_m')
-            ci_job_time_s = ci_job_match.group('time_s')
-
-            if ci_job_time_h:
-                job['total_sec'] += \
-                    int(str(ci_job_time_h).strip().rstrip('h')) * 3600
-            if ci_job_time_m:
-                job['total_sec'] += \
-                    int(str(ci_job_time_m).strip().rstrip('m')) * 60
-            if ci_job_time_s:
-                job['total_sec'] += \
-                    int(str(ci_job_time_s).strip().rstrip('s'))
+            # mash time fields together into total seconds for job, the
+            # groups capture just the digits (hours and minutes optional)
+            job['total_sec'] = (
+                int(ci_job_match.group('time_h') or 0) * 3600 +
+                int(ci_job_match.group('time_m') or 0) * 60 +
+                int(ci_job_match.group('time_s')))
 
             job['non_voting'] = ci_job_match.group('non_voting')
             if len(ci_job_match.group('the_rest')) > 0:
                 raise Exception('unexpected content in job: %s'
                                 % ci_job_match.group('the_rest'))
             run['jobs'].append(job)
+
+    if len(_parsed_runs) >= PARSED_RUNS_MAX:
+        _parsed_runs.clear()
+    _parsed_runs[key] = run
     return run
 
 
 def parse_promotion_success(msg):
-    promotion_success_patt = '(Patch Set \d+:\n\n)?Promotion review .+ has brought into alpha channel' # noqa
-    promotion_success_re = re.compile(promotion_success_patt)
-    return promotion_success_re.match(msg)
+    return PROMOTION_SUCCESS_RE.match(msg)
 
 
 def parse_promotion_failure(msg):
-    promotion_failure_patt = '(Patch Set \d+:\n\n)?PROMOTION FAILURE\n\nPromotion of artifacts from this change into Alpha channel has failed' # noqa
-    promotion_failure_re = re.compile(promotion_failure_patt)
-    return promotion_failure_re.match(msg)
+    return PROMOTION_FAILURE_RE.match(msg)
@@ -15,9 +15,19 @@
 #
 
 
+import json
 import logging
 import sys
 
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def configure_logging(args):
     """Configure logging.
@@ -36,10 +46,6 @@ def configure_logging(args):
     import requests.packages.urllib3
     requests.packages.urllib3.disable_warnings()
 
-    # Set root logger level to DEBUG, and use the
-    # handler level to control verbosity.
-    logging.getLogger().setLevel(logging.DEBUG)
-
     ch = logging.StreamHandler(stream=sys.stderr)
     ch.setLevel(logging.INFO)
     if args.log_quietly:
@@ -62,3 +68,54 @@ def configure_logging(args):
         fh_format = logging.Formatter(log_format)
         fh.setFormatter(fh_format)
         logging.getLogger().addHandler(fh)
+
+    # Set root logger level to the most verbose handler level, the handler
+    # levels control verbosity and log.isEnabledFor() can be used to skip
+    # building debug output that no handler would emit.
+    logging.getLogger().setLevel(
+        min(h.level for h in logging.getLogger().handlers))
+
+
+def call_with_logging(args, func, *func_args):
+    """Call func(*func_args) in a worker process with logging configured.
+
+    A forked worker inherits the handlers configure_logging installed in
+    the parent, a spawned one starts without any and would drop all of its
+    log output, so configure them from args first in that case.
+    """
+    if not logging.getLogger().handlers:
+        configure_logging(args)
+    return func(*func_args)
+
+
+def json_loads(data):
+    """Decode JSON text or bytes, using orjson if it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def pretty_json(data):
+    """Pretty print JSON data, usually for logging purposes."""
+    if orjson is not None:
+        return orjson.dumps(
+            data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS |
+            orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+def create_session(verify=False):
+    """Create a requests session shared by all Gerrit/GitHub queries.
+
+    Connections are pooled and kept alive between requests and requests
+    failing with a transient gateway error are retried with a backoff.
+    """
+    session = requests.Session()
+    session.verify = verify
+    retries = Retry(total=3, backoff_factor=0.3,
+                    status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64,
+                          max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -32,20 +32,22 @@ Terminology:
 from __future__ import division
 
 import argparse
-import json
 import logging
+import multiprocessing
 import os
 import re
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
 
 import jinja2
+import numpy as np
 import pandas as pd
 import pkg_resources
 import plotly
-import requests
 from plotly import graph_objs as go
 import urllib
 
@@ -55,11 +57,40 @@ import zingstats.changes
 
 CI_FAILURE_STATUSES = ['failed']
 CI_SUCCESS_STATUSES = ['succeeded', 'successful', 'ok']
+# normalised CI run status to the stat it is counted in, one lookup per run
+CI_STATUS_STATS = dict(
+    [(status, 'ci_success') for status in CI_SUCCESS_STATUSES] +
+    [(status, 'ci_failure') for status in CI_FAILURE_STATUSES])
+# strips punctuation from a CI run status before comparing it to the above
+STATUS_STRIP_RE = re.compile(r'\W+')
 
 GITHUB_TIMESTAMP = '%Y-%m-%dT%H:%M:%SZ'
+GITHUB_MAX_WORKERS = 8
+
+# plot frame columns in the order the reports list them
+PLOT_COLUMNS = ['created', 'merged', 'updated',
+                'ci_total_time_sec', 'ci_longest_time_sec',
+                'ci_success', 'ci_failure',
+                'promotion_success', 'promotion_failure',
+                'lifespan_sec', 'recheck', 'reverify', 'revisions']
+# how each column is aggregated into the plot buckets, one reduction per
+# group of columns rather than a per column mapping passed to agg()
+PLOT_SUM_COLUMNS = ['created', 'merged', 'updated',
+                    'ci_total_time_sec', 'ci_success', 'ci_failure',
+                    'promotion_success', 'promotion_failure',
+                    'recheck', 'reverify']
+PLOT_MAX_COLUMNS = ['ci_longest_time_sec', 'lifespan_sec']
+PLOT_MEAN_COLUMNS = ['revisions']
 
 ISSUES_URL = 'https://github.com/HewlettPackard/zing-stats/issues'
 
+# version banner at the top of the plotly.js bundled with plotly
+PLOTLYJS_VERSION_RE = re.compile(r'plotly\.js v(?P<version>[\w.-]+)')
+
+# jinja2 environments keyed by template directory, see get_html_template,
+# held per report worker process and reused for each report it writes
+_template_environments = dict()
+
 
 log = logging.getLogger(__name__)
 
@@ -151,7 +182,7 @@ def main():
                         help='Verify https requests (def: %(default)s).')
     parser.add_argument('-f', '--format', dest='report_format',
                         help='report format (def: %(default)s)',
-                        choices=['html', 'json'],
+                        choices=['html', 'json', 'parquet'],
                         default='html')
     parser.add_argument('--report-issue-link', dest='report_issue_link',
                         default=ISSUES_URL,
@@ -190,6 +221,13 @@ def main():
     zingstats.util.configure_logging(args)
     log.debug("Called with args: %s", args)
 
+    # fail now rather than after gathering everything, when the reports are
+    # written
+    if args.report_format == 'parquet' and not parquet_engine_available():
+        log.critical('parquet reports need pyarrow or fastparquet, e.g. '
+                     'pip install zingstats[parquet]')
+        exit(1)
+
     if args.branches:
         log.info('Reporting only on changes to these branches: %s',
                  ','.join(args.branches))
@@ -207,8 +245,7 @@ def main():
 
     gerrit_projects = [x['name'] for x in projects.get('gerrit', dict())]
     gerrit_query = 'status:open OR status:closed'
-    session = requests.Session()
-    session.verify = args.verify_https_requests
+    session = zingstats.util.create_session(args.verify_https_requests)
     if len(gerrit_projects) > 0:
         gerrit_changes = zingstats.changes.GerritChanges(args.gerrit_url,
                                                          gerrit_query,
@@ -229,7 +266,7 @@ def main():
 
     if len(projects.get('github')) > 0:
         github_pr_count, github_prs, not_found_proj = \
-            gather_github_prs(args, start_dt, projects)
+            gather_github_prs(args, start_dt, projects, session)
     else:
         github_pr_count = 0
         github_prs = list()
@@ -243,11 +280,23 @@ def main():
                  not_found_proj)
 
 
+def parquet_engine_available():
+    """Returns True if pandas has an engine to write parquet files with"""
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+        except ImportError:
+            continue
+        return True
+    return False
+
+
 def read_from_json(json_file):
-    with open(json_file, 'r') as f:
+    # read bytes, json_loads decodes them without an intermediate copy
+    with open(json_file, 'rb') as f:
         data = f.read()
     try:
-        json_data = json.loads(data)
+        json_data = zingstats.util.json_loads(data)
     except ValueError:
         log.critical('%s is not well-formed json', json_file)
         exit(1)
@@ -259,32 +308,46 @@ def generate_dataframes(args, changes, prs, start_dt):
     Create pandas dataframes for data of interest for subsequent analysis
     by different time periods.
     """
+    jobs = [(project, changes[project], parse_change, parse_ci_stats)
+            for project in sorted(changes)]
+    jobs += [(project, prs[project], parse_pr, parse_pr_ci_stats)
+             for project in sorted(prs)]
 
+    # parsing is CPU bound and independent for each project, so spread the
+    # projects over a process per core
     df = dict()
-    for project in sorted(changes):
-        df_change_stats = parse_change_stats(args, changes[project], start_dt,
-                                             zingstats.changes.GerritChange.GERRIT_FORMAT,  # noqa
-                                             parse_change)
-        df_ci_stats = parse_ci_stats(changes[project], start_dt)
-        project_dataframe(df, df_change_stats, df_ci_stats, project)
-
-    for project in sorted(prs):
-        df_change_stats = parse_change_stats(args, prs[project], start_dt,
-                                             GITHUB_TIMESTAMP, parse_pr)
-        df_ci_stats = parse_pr_ci_stats(prs[project], start_dt)
-        project_dataframe(df, df_change_stats, df_ci_stats, project)
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(zingstats.util.call_with_logging, args,
+                                   parse_project_stats, args,
+                                   project_changes, start_dt, change_parser,
+                                   ci_parser)
+                   for _, project_changes, change_parser, ci_parser in jobs]
+        for (project, _, _, _), future in zip(jobs, futures):
+            df_change_stats, df_ci_stats = future.result()
+            project_dataframe(df, df_change_stats, df_ci_stats, project)
 
     return df
 
 
+def parse_project_stats(args, changes, start_dt, change_parser, ci_parser):
+    """
+    Returns the change stats and ci stats DataFrames for one project
+    """
+    df_change_stats = parse_change_stats(args, changes, start_dt,
+                                         change_parser)
+    df_ci_stats = ci_parser(changes, start_dt)
+    return df_change_stats, df_ci_stats
+
+
 def project_dataframe(df, df_change_stats, df_ci_stats, project):
     if project in df:
         log.error(
             'Already processed %s, is the same project in gerrit and github?',
             project)
         exit(1)
-    df[project] = pd.concat([df_change_stats, df_ci_stats], sort=True)
-    df[project].index = pd.to_datetime(df[project].index, utc=True)
+    # both frames are already indexed by UTC datetimes, so concatenate
+    # without sorting the columns and sort the rows just once
+    df[project] = pd.concat([df_change_stats, df_ci_stats], sort=False)
     df[project].sort_index(inplace=True)
     df[project].fillna(value=0, inplace=True)
     if df[project].index.tz is None:
@@ -299,33 +362,82 @@ def write_report(args, df, num_changes, start_dt, finish_dt, projects,
     projects_map = generate_projects_map(projects, teams_map)
     file_prefix = report_file_prefix(args)
 
-    for team in sorted(teams_map):
-        team_projects = teams_map[team]
-        teams = sorted(teams_map.keys())
-        reorder_teams_map(teams)
-        output = None
-        if args.report_format == 'html':
-            output = generate_html(args, df, num_changes, start_dt, finish_dt,
-                                   team_projects, projects_map, not_found_proj,
-                                   team, teams)
-        elif args.report_format == 'json':
-            output = generate_json(args, df, num_changes, start_dt, finish_dt,
-                                   team_projects, projects_map, not_found_proj,
-                                   team, teams)
-        else:
-            log.critical('%s output is not a supported', args.report_format)
-            exit(1)
-        write_file(args, file_prefix, output, team)
+    teams = sorted(teams_map)
+    reorder_teams_map(teams)
+    # each team's report is CPU bound (plots and templating) and does not
+    # depend on the others, so generate them in a process per core, each
+    # getting only the frames of its own projects
+    # teams often cover the same projects (e.g. All and gerrit when there
+    # are no github projects), so their plot frames are built here once and
+    # handed to the workers rather than rebuilt in each of them
+    plot_frames = dict()
+    # the plots no longer embed plotly.js, the html reports load the version
+    # the installed plotly was written for from the CDN
+    plotlyjs_version = None
+    if args.report_format == 'html':
+        plotlyjs_version = get_plotlyjs_version()
+    max_workers = min(len(teams), multiprocessing.cpu_count())
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        reports = list()
+        for team in sorted(teams_map):
+            team_projects = sorted(teams_map[team])
+            team_df = dict((project, df[project]) for project in team_projects
+                           if project in df)
+            team_frames = dict()
+            if team_df:
+                key = frozenset(team_df)
+                generate_plot(args, dict(team_df), sorted(key), start_dt,
+                              plot_frames)
+                team_frames[key] = plot_frames[key]
+            reports.append(executor.submit(
+                zingstats.util.call_with_logging, args,
+                write_team_report, args, team_df, num_changes, start_dt,
+                finish_dt, team_projects, projects_map, not_found_proj, team,
+                teams, file_prefix, team_frames, plotlyjs_version))
+        for report in reports:
+            report.result()
+
+
+def write_team_report(args, df, num_changes, start_dt, finish_dt,
+                      team_projects, projects_map, not_found_proj, team,
+                      teams, file_prefix, plot_frames=None,
+                      plotlyjs_version=None):
+    output = None
+    if args.report_format == 'html':
+        output = generate_html(args, df, num_changes, start_dt, finish_dt,
+                               team_projects, projects_map, not_found_proj,
+                               team, teams, plot_frames, plotlyjs_version)
+    elif args.report_format == 'json':
+        output = generate_json(args, df, num_changes, start_dt, finish_dt,
+                               team_projects, projects_map, not_found_proj,
+                               team, teams, plot_frames)
+    elif args.report_format == 'parquet':
+        output = generate_parquet(args, df, num_changes, start_dt, finish_dt,
+                                  team_projects, projects_map, not_found_proj,
+                                  team, teams, plot_frames)
+    else:
+        log.critical('%s output is not a supported', args.report_format)
+        exit(1)
+    write_file(args, file_prefix, output, team)
 
 
 def write_file(args, file_prefix, report, team):
     dir_path = os.path.join(args.output_dir, file_prefix)
     file_name = report_file_name(team, args.report_format)
     file_path = os.path.join(dir_path, file_name)
-    if not os.path.exists(dir_path):
+    # team reports are written concurrently, another may have made it first
+    try:
         os.makedirs(dir_path)
-    with open(file_path, 'w') as f:
-        f.write(report)
+    except OSError:
+        if not os.path.isdir(dir_path):
+            raise
+    with open(file_path, 'wb') as f:
+        if isinstance(report, jinja2.environment.TemplateStream):
+            report.dump(f, encoding='utf-8')
+        elif isinstance(report, pd.DataFrame):
+            report.to_parquet(f)
+        else:
+            f.write(report.encode('utf-8'))
     log.info('Wrote %s for team: "%s"', file_path, team)
 
 
@@ -359,35 +471,30 @@ def report_file_prefix(args):
 def generate_projects_map(projects, teams_map):
     projects_map = dict()
     for system in ['gerrit', 'github']:
-        teams_map[system] = list()
+        teams_map[system] = set()
         for project in projects[system]:
             name = project['name']
             projects_map[name] = system
-            if name not in teams_map[system]:
-                teams_map[system].append(name)
+            teams_map[system].add(name)
 
     log.debug('projects map: %s', projects_map)
     return projects_map
 
 
 def generate_teams_map(projects):
-    teams_map = dict()
-    teams_map['All'] = list()
+    # sets of project names keyed by team, sorted where they are used
+    teams_map = defaultdict(set)
+    teams_map['All'] = set()
     for project in projects['gerrit'] + projects['github']:
-        team = project['team']
         name = project['name']
-        if team not in teams_map:
-            teams_map[team] = list()
-        if name not in teams_map['All']:
-            teams_map['All'].append(name)
-        if name not in teams_map[team]:
-            teams_map[team].append(name)
+        teams_map['All'].add(name)
+        teams_map[project['team']].add(name)
 
     log.debug('teams map: %s', teams_map)
     return teams_map
 
 
-def gather_github_prs(args, oldest_timestamp, projects):
+def gather_github_prs(args, oldest_timestamp, projects, session):
     projects_github = [x['name'] for x in projects.get('github', dict())]
 
     if len(projects_github) < 1:
@@ -398,77 +505,151 @@ def gather_github_prs(args, oldest_timestamp, projects):
     total_prs = 0
     prs = dict()
     not_found_proj = list()
-    session = requests.Session()
-    for project in projects_github:
-        prs[project] = dict()
+    # listing PRs is network bound so gather the projects concurrently
+    with ThreadPoolExecutor(max_workers=GITHUB_MAX_WORKERS) as executor:
+        project_prs = executor.map(
+            lambda project: gather_github_project_prs(
+                args, oldest_timestamp, project, session),
+            projects_github)
+        for project, project_pr in zip(projects_github, project_prs):
+            if project_pr is None:
+                not_found_proj.append(project)
+                continue
+            prs[project] = project_pr
+            log.info('Gathered %d PRs for %s', len(prs[project]), project)
+            total_prs += len(prs[project])
+
+        # commits are only needed for the PRs merged in the window, fetch
+        # them all concurrently rather than one at a time while parsing
+        merged_prs = [pr for project_prs in prs.values()
+                      for pr in project_prs.values()
+                      if pr['merged_at'] and
+                      github_ts_to_dt(pr['merged_at']) >= oldest_timestamp]
+        # Assume we won't have more than 250 commits on a PR for now ...
+        pr_commits = executor.map(
+            lambda pr: github_query(args, pr['commits_url'], session),
+            merged_prs)
+        for pr, commits in zip(merged_prs, pr_commits):
+            pr['commits'] = commits
+
+        # the prefetched comments only go back to oldest_timestamp, PRs
+        # merged in the window but created before it need all of theirs
+        old_prs = [pr for pr in merged_prs
+                   if github_ts_to_dt(pr['created_at']) < oldest_timestamp]
+        pr_comments = executor.map(
+            lambda pr: github_query(args, pr['comments_url'], session),
+            old_prs)
+        for pr, comments in zip(old_prs, pr_comments):
+            pr['comments'] = comments
+
+    log.info('Gathered %d total PRs', total_prs)
+
+    return total_prs, prs, not_found_proj
 
-        project_finished = False
-        next_page = True
 
-        payload = {'state': 'all', 'sort': 'updated', 'direction': 'dsc'}
-        query = ('%s/api/v3/repos/%s/pulls'
-                 % (args.github_url, project))
-        while next_page:
+def gather_github_project_prs(args, oldest_timestamp, project, session):
+    """
+    Returns a dict of the PRs for project updated since oldest_timestamp
+    keyed by PR id, or None if the project could not be found
+    """
+    prs = dict()
+
+    # github timestamps sort as strings, so compare them to the first whole
+    # second that is not older than oldest_timestamp rather than parsing
+    # every one of them
+    oldest_second = oldest_timestamp.replace(microsecond=0)
+    if oldest_second < oldest_timestamp:
+        oldest_second += timedelta(seconds=1)
+    oldest_ts = oldest_second.strftime(GITHUB_TIMESTAMP)
+
+    project_finished = False
+    next_page = True
+
+    payload = {'state': 'all', 'sort': 'updated', 'direction': 'dsc'}
+    query = ('%s/api/v3/repos/%s/pulls'
+             % (args.github_url, project))
+    while next_page:
+        if args.github_token:
+            payload['access_token'] = args.github_token
+            response = session.get(
+                query, params=payload,
+                verify=args.verify_https_requests)
+        else:
+            response = session.get(query, params=payload,
+                                   verify=args.verify_https_requests)
+        log.debug(response.url)
+        if response.status_code == 404:
             if args.github_token:
-                payload['access_token'] = args.github_token
-                response = session.get(
-                    query, params=payload,
-                    verify=args.verify_https_requests)
+                log.error('Skipping %s (404 while listing PRs, the '
+                          '--github-token specified '
+                          'does not have access to this project)', project)
             else:
-                response = session.get(query, params=payload,
-                                       verify=args.verify_https_requests)
-            log.debug(response.url)
-            if response.status_code == 404:
-                if args.github_token:
-                    log.error('Skipping %s (404 while listing PRs, the '
-                              '--github-token specified '
-                              'does not have access to this project)', project)
-                else:
-                    log.error('Skipping %s (404 while listing PRs, try '
-                              'providing a --github-token '
-                              'with access to this project)', project)
-                prs.pop(project)
-                not_found_proj.append(project)
-                break
-            results = response.json()
-            # TODO use functools and helper function to have log.debug() only
-            # resolve the json.dumps() if needed (all usages of this pattern)
-            log.debug(json.dumps(results, sort_keys=True, indent=4,
-                                 separators=(',', ': ')))
-            for pr in results:
-                log.debug(json.dumps(pr, sort_keys=True, indent=4,
-                                     separators=(',', ': ')))
-                if args.branches and pr['base']['ref'] not in args.branches:
-                    log.debug(
-                        'Skipping %s on %s (not in branches to analyse - %s)',
-                        pr['id'], pr['base']['ref'], ','.join(args.branches))
-                    continue
-                current_timestamp = datetime.strptime(pr['updated_at'],
-                                                      GITHUB_TIMESTAMP)
-                if current_timestamp < oldest_timestamp:
-                    log.debug('%s is older than %s, skip further PRs for %s',
-                              current_timestamp, oldest_timestamp, project)
-                    results[-1].pop('_more_changes', None)
-
-                    project_finished = True
-                    break
-                prs[project][pr['id']] = pr
-
-            if project_finished:
+                log.error('Skipping %s (404 while listing PRs, try '
+                          'providing a --github-token '
+                          'with access to this project)', project)
+            return None
+        results = zingstats.util.json_loads(response.content)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(zingstats.util.pretty_json(results))
+        for pr in results:
+            if args.branches and pr['base']['ref'] not in args.branches:
+                log.debug(
+                    'Skipping %s on %s (not in branches to analyse - %s)',
+                    pr['id'], pr['base']['ref'], ','.join(args.branches))
+                continue
+            if pr['updated_at'] < oldest_ts:
+                log.debug('%s is older than %s, skip further PRs for %s',
+                          pr['updated_at'], oldest_timestamp, project)
+                project_finished = True
                 break
+            prs[pr['id']] = pr
 
-            next_page = response.links.get('next', False)
-            if next_page:
-                query = next_page['url']
-                payload['access_token'] = None
+        if project_finished:
+            break
 
-        if project in prs:
-            log.info('Gathered %d PRs for %s', len(prs[project]), project)
-            total_prs += len(prs[project])
+        next_page = response.links.get('next', False)
+        if next_page:
+            query = next_page['url']
+            payload['access_token'] = None
 
-    log.info('Gathered %d total PRs', total_prs)
+    if prs:
+        # only comments updated in the window, gather_github_prs fetches the
+        # rest for the PRs that need them
+        comments = prefetch_github_comments(args, project, oldest_ts, session)
+        for pr in prs.values():
+            pr['comments'] = comments.get(pr['number'], list())
+
+    return prs
 
-    return total_prs, prs, not_found_proj
+
+def prefetch_github_comments(args, project, since, session):
+    """
+    Returns a dict of lists of issue comments keyed by PR number, gathered
+    with the repo wide comments endpoint rather than a query per PR
+    """
+    comments = defaultdict(list)
+    payload = {'since': since, 'per_page': 100}
+    if args.github_token:
+        payload['access_token'] = args.github_token
+    query = ('%s/api/v3/repos/%s/issues/comments'
+             % (args.github_url, project))
+    while query:
+        response = session.get(query, params=payload,
+                               verify=args.verify_https_requests)
+        log.debug('github comments url: %s', response.url)
+        for comment in zingstats.util.json_loads(response.content):
+            number = int(comment['issue_url'].rsplit('/', 1)[-1])
+            comments[number].append(comment)
+
+        next_page = response.links.get('next')
+        # the next link already carries the query parameters
+        query = next_page['url'] if next_page else None
+        payload = {'access_token': args.github_token} \
+            if args.github_token else None
+
+    log.debug('Gathered comments for %d issues/PRs in %s', len(comments),
+              project)
+    return comments
 
 
 def get_changes_by_project(changes):
@@ -481,7 +662,20 @@ def get_changes_by_project(changes):
     return changes_by_project
 
 
-def parse_change_stats(args, changes, start_dt, ts_format, change_parser):
+class ChangeStats(object):
+    """
+    Accumulates the activity counted by parse_change/parse_pr for
+    parse_change_stats
+    """
+    def __init__(self):
+        # (timestamp, column) for every event counted
+        self.activity = list()
+        # set once per merged change, keyed by merge timestamp
+        self.revisions = dict()
+        self.lifespan_sec = dict()
+
+
+def parse_change_stats(args, changes, start_dt, change_parser):
     """
     Returns a pandas DataFrame with
         a count of changes created
@@ -492,142 +686,133 @@ def parse_change_stats(args, changes, start_dt, ts_format, change_parser):
         recheck and reverify counts for each merged change
     from the json list of changes passed
     """
-    created = defaultdict(int)
-    updated = defaultdict(int)
-    merged = defaultdict(int)
-    revisions = dict()
-    lifespan_sec = dict()
-    recheck = defaultdict(int)
-    reverify = defaultdict(int)
-
-    for change_id in changes:
-        session = requests.Session()
-        change_parser(args, change_id, changes, created, lifespan_sec, merged,
-                      recheck, reverify, revisions, start_dt, ts_format,
-                      updated, session)
-
-    d = {'created': created,
-         'updated': updated,
-         'merged': merged,
-         'revisions': revisions,
-         'lifespan_sec': lifespan_sec,
-         'recheck': recheck,
-         'reverify': reverify}
+    stats = ChangeStats()
+    for change in changes.values():
+        change_parser(args, change, start_dt, stats)
 
     # specify columns to enforce order, easier for debugging
-    df = pd.DataFrame(d,
-                      columns=['created',
-                               'updated',
-                               'merged',
-                               'revisions',
-                               'lifespan_sec',
-                               'recheck',
-                               'reverify'])
+    columns = ['created',
+               'updated',
+               'merged',
+               'revisions',
+               'lifespan_sec',
+               'recheck',
+               'reverify']
+    if stats.activity:
+        # count events per timestamp in one groupby rather than bumping a
+        # python counter per event
+        df = pd.DataFrame(stats.activity, columns=['ts', 'column']).groupby(
+            ['ts', 'column']).size().unstack(fill_value=0)
+        df = df.join(pd.DataFrame({'revisions': stats.revisions,
+                                   'lifespan_sec': stats.lifespan_sec}),
+                     how='outer')
+        df = df.reindex(columns=columns)
+        df.index.name = None
+        df.columns.name = None
+    else:
+        # numeric like the counted frames, an object column would stay
+        # object through the concat with other projects and the plot sums
+        df = pd.DataFrame(columns=columns, dtype='float64')
+    df.index = pd.to_datetime(df.index, utc=True)
     log.debug('activity df:\n%s', df)
     return df
 
 
-def parse_change(args, change_id, changes, created, lifespan_sec, merged,
-                 recheck, reverify, revisions, start_dt, ts_format, updated,
-                 session):
-    change = changes[change_id]
-    msg = 'project|change: %s|%s' % (change.project, change.number)
+def parse_change(args, change, start_dt, stats):
     if change.created_dt >= start_dt:
-        created[change.created_dt] += 1
-        log.debug('created set to %d for %s', created[change.created_dt], msg)
+        stats.activity.append((change.created_dt, 'created'))
+        log.debug('created counted for project|change: %s|%s',
+                  change.project, change.number)
     if change.updated_dt >= start_dt:
-        updated[change.updated_dt] += 1
-        log.debug('updated set to %d for %s', updated[change.updated_dt], msg)
+        stats.activity.append((change.updated_dt, 'updated'))
+        log.debug('updated counted for project|change: %s|%s',
+                  change.project, change.number)
     if change.status == 'MERGED' and change.merged_dt >= start_dt:
-        merged[change.merged_dt] += 1
-        log.debug('merged set to %d for %s', merged[change.merged_dt], msg)
-        revisions[change.merged_dt] = change.rev_count()
+        stats.activity.append((change.merged_dt, 'merged'))
+        log.debug('merged counted for project|change: %s|%s',
+                  change.project, change.number)
+        stats.revisions[change.merged_dt] = change.rev_count()
         lifespan = (change.merged_dt - change.created_dt).total_seconds()
-        lifespan_sec[change.merged_dt] = lifespan
-        log.debug('age set to %d s for %s', lifespan_sec[change.merged_dt],
-                  msg)
+        stats.lifespan_sec[change.merged_dt] = lifespan
+        log.debug('age set to %d s for project|change: %s|%s', lifespan,
+                  change.project, change.number)
 
         for revision in change.revisions():
             for message in revision.messages():
-                msg = 'project|change|rev: %s|%s|%s' %\
-                      (change.project, change.number, revision.number)
-                if 'recheck' in message.text.lower():
-                    recheck[change.merged_dt] += 1
-                    log.debug('recheck set to %d for %s',
-                              recheck[change.merged_dt], msg)
-                elif 'reverify' in message.text.lower():
-                    reverify[change.merged_dt] += 1
-                    log.debug('reverify set to %d for %s',
-                              reverify[change.merged_dt], msg)
-
-
-def parse_pr(args, pr_id, prs, created, lifespan_sec, merged, recheck,
-             reverify, revisions, start_dt, ts_format, updated, session):
-    pr = prs[pr_id]
+                lowered = message.text.lower()
+                if 'recheck' in lowered:
+                    column = 'recheck'
+                elif 'reverify' in lowered:
+                    column = 'reverify'
+                else:
+                    continue
+                stats.activity.append((change.merged_dt, column))
+                log.debug('%s counted for project|change|rev: %s|%s|%s',
+                          column, change.project, change.number,
+                          revision.number)
+
+
+def parse_pr(args, pr, start_dt, stats):
+    pr_id = pr['id']
     created_ts = pr['created_at']
-    created_dt = datetime.strptime(created_ts, ts_format)
+    created_dt = github_ts_to_dt(created_ts)
     pr['created_dt'] = created_dt
     updated_ts = pr['updated_at']
-    updated_dt = datetime.strptime(updated_ts, ts_format)
+    updated_dt = github_ts_to_dt(updated_ts)
     pr['updated_dt'] = updated_dt
     merged_ts = pr['merged_at']
     if pr['merged_at']:
-        merged_dt = datetime.strptime(merged_ts, ts_format)
+        merged_dt = github_ts_to_dt(merged_ts)
         pr['merged_dt'] = merged_dt
-    # Assume we won't have more than 250 commits on a PR for now ...
-    commits = github_query(args, pr['commits_url'], session)
-    log.debug('commits: %s',
-              json.dumps(commits, sort_keys=True, indent=4,
-                         separators=(',', ': ')))
-    pr['commits'] = commits
-    comments = github_query(args, pr['comments_url'], session)
-    log.debug('comments: %s',
-              json.dumps(comments, sort_keys=True, indent=4,
-                         separators=(',', ': ')))
-    pr['comments'] = comments
-    msg_details = 'project|pr|id: %s|%s|%s' % (
-        pr['base']['repo']['full_name'], pr['number'], pr_id)
+    # comments are prefetched in gather_github_prs
+    comments = pr['comments']
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('comments: %s', zingstats.util.pretty_json(comments))
+    project = pr['base']['repo']['full_name']
     if created_dt >= start_dt:
-        created[created_ts] += 1
-        log.debug('created set to %d with %s',
-                  created[created_ts],
-                  msg_details)
+        stats.activity.append((created_ts, 'created'))
+        log.debug('created counted with project|pr|id: %s|%s|%s', project,
+                  pr['number'], pr_id)
     if updated_dt >= start_dt:
-        updated[updated_ts] += 1
-        log.debug('updated set to %d with %s',
-                  updated[updated_ts],
-                  msg_details)
+        stats.activity.append((updated_ts, 'updated'))
+        log.debug('updated counted with project|pr|id: %s|%s|%s', project,
+                  pr['number'], pr_id)
     if pr['merged_at'] and merged_dt >= start_dt:
-        merged[merged_ts] += 1
-        log.debug('merged set to %d with %s',
-                  merged[merged_ts],
-                  msg_details)
+        stats.activity.append((merged_ts, 'merged'))
+        log.debug('merged counted with project|pr|id: %s|%s|%s', project,
+                  pr['number'], pr_id)
 
-        revisions[merged_ts] = len(commits)
+        # commits are prefetched for merged PRs in gather_github_prs
+        commits = pr['commits']
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('commits: %s', zingstats.util.pretty_json(commits))
+        stats.revisions[merged_ts] = len(commits)
 
-        lifespan_sec[merged_ts] = (
+        stats.lifespan_sec[merged_ts] = (
             merged_dt - created_dt).total_seconds()
-        log.debug('pr lifespan set to %d with %s',
-                  lifespan_sec[merged_ts],
-                  msg_details)
+        log.debug('pr lifespan set to %d with project|pr|id: %s|%s|%s',
+                  stats.lifespan_sec[merged_ts], project, pr['number'], pr_id)
 
         for comment in comments:
-            msg_details = 'project|pr|id|comment: %s|%s|%s|%s' % (
-                pr['base']['repo']['full_name'], pr['number'], pr_id,
-                comment['id'])
+            lowered = comment['body'].lower()
+            if 'recheck' in lowered:
+                column = 'recheck'
+            elif 'reverify' in lowered:
+                column = 'reverify'
+            else:
+                continue
+            stats.activity.append((merged_ts, column))
+            log.debug('%s counted with project|pr|id|comment: '
+                      '%s|%s|%s|%s', column, project, pr['number'], pr_id,
+                      comment['id'])
 
-            if 'recheck' in comment['body'].lower():
-                recheck[merged_ts] += 1
-                log.debug(
-                    'recheck updated to %d with %s',
-                    recheck[merged_ts],
-                    msg_details)
-            elif 'reverify' in comment['body'].lower():
-                reverify[merged_ts] += 1
-                log.debug(
-                    'reverify updated to %d with %s',
-                    reverify[merged_ts],
-                    msg_details)
+
+def github_ts_to_dt(github_ts):
+    """Convert GitHub format timestamp (YYYY-MM-DDTHH:MM:SSZ) to datetime."""
+    # much faster than strptime(github_ts, GITHUB_TIMESTAMP)
+    return datetime(int(github_ts[0:4]), int(github_ts[5:7]),
+                    int(github_ts[8:10]), int(github_ts[11:13]),
+                    int(github_ts[14:16]), int(github_ts[17:19]))
 
 
 def github_query(args, query_url, session):
@@ -640,7 +825,48 @@ def github_query(args, query_url, session):
         response = session.get(query_url,
                                verify=args.verify_https_requests)
     log.debug('github query url: %s', response.url)
-    return response.json()
+    return zingstats.util.json_loads(response.content)
+
+
+class CIStats(object):
+    """
+    Accumulates the CI activity counted by parse_ci_stats/parse_pr_ci_stats
+    as one list per column, with a slot in each list per timestamp
+    """
+    COLUMNS = ['ci_total_time_sec', 'ci_longest_time_sec',
+               'ci_success', 'ci_failure',
+               'promotion_success', 'promotion_failure']
+
+    def __init__(self):
+        self.timestamps = list()
+        self.slots = dict()
+        self.ci_total_time_sec = list()
+        self.ci_longest_time_sec = list()
+        self.ci_success = list()
+        self.ci_failure = list()
+        self.promotion_success = list()
+        self.promotion_failure = list()
+
+    def slot(self, ts):
+        """Returns the index of ts in the column lists, adding it if new"""
+        i = self.slots.get(ts)
+        if i is None:
+            i = self.slots[ts] = len(self.timestamps)
+            self.timestamps.append(ts)
+            for column in CIStats.COLUMNS:
+                getattr(self, column).append(0)
+        return i
+
+    def dataframe(self):
+        """Returns the columns as a DataFrame indexed by UTC datetimes"""
+        # with no activity the empty columns would otherwise be objects,
+        # see parse_change_stats
+        dtype = None if self.timestamps else 'float64'
+        return pd.DataFrame(
+            dict((column, getattr(self, column))
+                 for column in CIStats.COLUMNS),
+            index=pd.to_datetime(self.timestamps, utc=True),
+            columns=CIStats.COLUMNS, dtype=dtype)
 
 
 def parse_ci_stats(changes, start_dt):
@@ -651,12 +877,9 @@ def parse_ci_stats(changes, start_dt):
         success and failure counts for each ci run of each updated change
     from the json list of changes passed
     """
-    ci_total_time_sec = defaultdict(int)
-    ci_longest_time_sec = defaultdict(int)
-    ci_success = defaultdict(int)
-    ci_failure = defaultdict(int)
-    promotion_success = defaultdict(int)
-    promotion_failure = defaultdict(int)
+    # building the debug messages is expensive, skip it unless needed
+    debug = log.isEnabledFor(logging.DEBUG)
+    stats = CIStats()
     for gerrit_id in changes:
         change = changes[gerrit_id]
         log.debug('change: %s', change.long_id)
@@ -664,6 +887,17 @@ def parse_ci_stats(changes, start_dt):
             for message in revision.messages():
                 log.debug('message: %s', message.text)
 
+                # ignore messages on changes that are older than start time,
+                # before running any of the parsers over them
+                if message.message_dt < start_dt:
+                    log.debug('discarding message on proj|change|rev: '
+                              '%s|%s|%s with date %s',
+                              change.project,
+                              change.long_id,
+                              revision.number,
+                              message.message_dt)
+                    continue
+
                 # TODO refactor injection of custom parsing in a generic way
                 # e.g. using a plugins structure, promotions may be very
                 # specific to some systems (as are the promotion messages)
@@ -673,49 +907,43 @@ def parse_ci_stats(changes, start_dt):
                     log.debug('%s %s (%s): promotion succeeded',
                               change.project, change.number,
                               message.message_dt)
-                    promotion_success[message.message_dt] += 1
+                    stats.promotion_success[
+                        stats.slot(message.message_dt)] += 1
                 promotion_failed = \
                     zingstats.parser.parse_promotion_failure(message.text)
                 if promotion_failed and message.message_dt > start_dt:
                     log.debug('%s %s (%s): promotion failed', change.project,
                               change.number, message.message_dt)
-                    promotion_failure[message.message_dt] += 1
+                    stats.promotion_failure[
+                        stats.slot(message.message_dt)] += 1
 
                 ci_run = zingstats.parser.parse_ci_job_comments(message)
                 log.debug('ci_run: %s', ci_run)
                 if ci_run:
-                    # ignore messages on changes that are older than start time
-                    if message.message_dt < start_dt:
-                        log.debug('discarding message on proj|change|rev|run: '
-                                  '%s|%s|%s|%s with date %s',
-                                  change.project,
-                                  change.long_id,
-                                  revision.number,
-                                  ci_run['num'],
-                                  message.message_dt)
-                        continue
-
-                    status = re.sub(r'\W+', '', ci_run['status'].lower())
-                    if status in CI_SUCCESS_STATUSES:
-                        ci_success[change.updated_dt] += 1
-                        log.debug(
+                    status = STATUS_STRIP_RE.sub('', ci_run['status'].lower())
+                    ci_stat = CI_STATUS_STATS.get(status)
+                    if ci_stat == 'ci_success':
+                        updated = stats.slot(change.updated_dt)
+                        stats.ci_success[updated] += 1
+                        if debug:
                             debug_msg_gerrit('ci_success',
-                                             ci_success[change.updated_dt],
+                                             stats.ci_success[updated],
                                              'run',
                                              change,
                                              revision,
                                              ci_run['num'],
-                                             'status: ' + ci_run['status']))
-                    elif status in CI_FAILURE_STATUSES:
-                        ci_failure[change.updated_dt] += 1
-                        log.debug(
+                                             'status: ' + ci_run['status'])
+                    elif ci_stat == 'ci_failure':
+                        updated = stats.slot(change.updated_dt)
+                        stats.ci_failure[updated] += 1
+                        if debug:
                             debug_msg_gerrit('ci_failure',
-                                             ci_failure[change.updated_dt],
+                                             stats.ci_failure[updated],
                                              'run',
                                              change,
                                              revision,
                                              ci_run['num'],
-                                             'status: ' + ci_run['status']))
+                                             'status: ' + ci_run['status'])
                     else:
                         # TODO add extra status to appropriate path above
                         log.warn('Unexpected status %s for %s on %s, skipping',
@@ -723,47 +951,41 @@ def parse_ci_stats(changes, start_dt):
                                  change.change_id)
                         continue
 
-                    if change.status == 'MERGED':
-                        for ci_job in ci_run['jobs']:
-                            ci_total_time_sec[change.merged_dt] += ci_job[
-                                'total_sec']
-                            log.debug(
-                                debug_msg_gerrit('ci_total_time_sec',
-                                                 ci_total_time_sec[change.merged_dt],  # noqa
+                    if change.status == 'MERGED' and ci_run['jobs']:
+                        merged = stats.slot(change.merged_dt)
+                        job_secs = [ci_job['total_sec']
+                                    for ci_job in ci_run['jobs']]
+                        run_sec = sum(job_secs)
+                        stats.ci_total_time_sec[merged] += run_sec
+                        if debug:
+                            debug_msg_gerrit('ci_total_time_sec',
+                                             stats.ci_total_time_sec[merged],
+                                             'run',
+                                             change,
+                                             revision,
+                                             ci_run['num'],
+                                             str(run_sec) + 's')
+
+                        # this could end up being the longest job across
+                        # multiple changes if two changes merge at the same
+                        # time (to the microsecond), so not going to worry
+                        # about that for now but log what we're doing so
+                        # someone can debug this in future
+                        longest_sec = max(job_secs)
+                        if longest_sec > stats.ci_longest_time_sec[merged]:
+                            stats.ci_longest_time_sec[merged] = longest_sec
+                            if debug:
+                                ci_job = ci_run['jobs'][
+                                    job_secs.index(longest_sec)]
+                                debug_msg_gerrit('ci_longest_time_sec',
+                                                 longest_sec,
                                                  'job',
                                                  change,
                                                  revision,
                                                  ci_job['name'],
-                                                 str(ci_job['total_sec']) + 's'))  # noqa
-
-                            # this could end up being the longest job across
-                            # multiple changes if two changes merge at the same
-                            # time (to the microsecond), so not going to worry
-                            # about that for now but log what we're doing so
-                            # someone can debug this in future
-                            if (ci_job['total_sec'] >
-                                    ci_longest_time_sec[change.merged_dt]):
-                                ci_longest_time_sec[change.merged_dt] = ci_job[
-                                    'total_sec']
-                                log.debug(
-                                    debug_msg_gerrit('ci_longest_time_sec',
-                                                     ci_longest_time_sec[change.merged_dt],  # noqa
-                                                     'job',
-                                                     change,
-                                                     revision,
-                                                     ci_job['name'],
-                                                     str(ci_job['total_sec']) + 's'))  # noqa
-
-    d = {'ci_total_time_sec': ci_total_time_sec,
-         'ci_longest_time_sec': ci_longest_time_sec,
-         'ci_success': ci_success,
-         'ci_failure': ci_failure,
-         'promotion_success': promotion_success,
-         'promotion_failure': promotion_failure}
-
-    df = pd.DataFrame(d, columns=['ci_total_time_sec', 'ci_longest_time_sec',
-                                  'ci_success', 'ci_failure',
-                                  'promotion_success', 'promotion_failure'])
+                                                 str(longest_sec) + 's')
+
+    df = stats.dataframe()
     log.debug('ci time status df:\n%s', df)
     return df
 
@@ -776,19 +998,24 @@ def parse_pr_ci_stats(prs, start_dt):
         success and failure counts for each ci run of each updated pr
     from the list of prs passed
     """
-    ci_total_time_sec = defaultdict(int)
-    ci_longest_time_sec = defaultdict(int)
-    ci_success = defaultdict(int)
-    ci_failure = defaultdict(int)
-    promotion_success = defaultdict(int)
-    promotion_failure = defaultdict(int)
+    # building the debug messages is expensive, skip it unless needed
+    debug = log.isEnabledFor(logging.DEBUG)
+    stats = CIStats()
     for pr_id in prs:
         pr = prs[pr_id]
         log.debug("pr %d", pr_id)
         for comment in pr['comments']:
             log.debug('comment: %s', comment)
             comment_ts = comment['created_at']
-            comment_dt = datetime.strptime(comment_ts, GITHUB_TIMESTAMP)
+            comment_dt = github_ts_to_dt(comment_ts)
+
+            # ignore comments that are older than our start time, before
+            # running any of the parsers over them
+            if comment_dt < start_dt:
+                log.debug('discarding comment %s on %s %s with date %s',
+                          comment['id'], pr['base']['repo']['full_name'],
+                          pr['number'], comment_ts)
+                continue
 
             # TODO refactor for injection of custom parsing in a generic way
             # e.g. using some kind of plugins structure, promotions may be very
@@ -799,48 +1026,38 @@ def parse_pr_ci_stats(prs, start_dt):
                 log.debug('%s %s (%s): promotion success',
                           pr['base']['repo']['full_name'], pr['number'],
                           comment_dt)
-                promotion_success[comment_ts] += 1
+                stats.promotion_success[stats.slot(comment_ts)] += 1
             promotion_failed = \
                 zingstats.parser.parse_promotion_failure(comment['body'])
             if promotion_failed and comment_dt > start_dt:
                 log.debug('%s %s (%s): promotion failure',
                           pr['base']['repo']['full_name'], pr['number'],
                           comment_dt)
-                promotion_failure[comment_ts] += 1
+                stats.promotion_failure[stats.slot(comment_ts)] += 1
 
             ci_run = zingstats.parser.parse_pr_message(comment)
             log.debug('ci_run: %s', ci_run)
             if ci_run:
-                log.debug(ci_run)
-                ci_run_ts = comment['created_at']
-                ci_run_dt = datetime.strptime(ci_run_ts, GITHUB_TIMESTAMP)
-
-                msg_details = 'project|pr|id|comment: %s|%s|%s|%s' % (
-                    pr['base']['repo']['full_name'], pr['number'], pr_id,
-                    comment['id'])
-
-                # ignore messages on changes that are older than our start time
-                # TODO (use comment_dt here and retire ci_run_ts and ci_run_dt)
-                if ci_run_dt < start_dt:
-                    log.debug('discarding comment on %s with date %s',
-                              msg_details, ci_run_ts)
-                    continue
-
                 updated_ts = pr['updated_at']
 
-                status = re.sub(r'\W+', '', ci_run['status'].lower())
-                if status in CI_SUCCESS_STATUSES:
-                    ci_success[updated_ts] += 1
-                    log.debug(
-                        debug_msg_github('ci_success', ci_success[updated_ts],
+                status = STATUS_STRIP_RE.sub('', ci_run['status'].lower())
+                ci_stat = CI_STATUS_STATS.get(status)
+                if ci_stat == 'ci_success':
+                    updated = stats.slot(updated_ts)
+                    stats.ci_success[updated] += 1
+                    if debug:
+                        debug_msg_github('ci_success',
+                                         stats.ci_success[updated],
                                          'run', pr, comment, None,
-                                         'status: ' + ci_run['status']))
-                elif status in CI_FAILURE_STATUSES:
-                    ci_failure[updated_ts] += 1
-                    log.debug(
-                        debug_msg_github('ci_failure', ci_failure[updated_ts],
+                                         'status: ' + ci_run['status'])
+                elif ci_stat == 'ci_failure':
+                    updated = stats.slot(updated_ts)
+                    stats.ci_failure[updated] += 1
+                    if debug:
+                        debug_msg_github('ci_failure',
+                                         stats.ci_failure[updated],
                                          'run', pr, comment, None,
-                                         'status: ' + ci_run['status']))
+                                         'status: ' + ci_run['status'])
                 else:
                     # TODO add extra status to appropriate path above
                     log.warn('Unexpected status %s for %s on %s, skipping',
@@ -848,80 +1065,65 @@ def parse_pr_ci_stats(prs, start_dt):
                              pr['base']['repo']['full_name'])
                     continue
 
-                if pr['merged_at']:
-                    merged_ts = pr['merged_at']
-                    for ci_job in ci_run['jobs']:
-                        ci_total_time_sec[merged_ts] += ci_job[
-                            'total_sec']
-                        log.debug(
-                            debug_msg_github('ci_total_time_sec',
-                                             ci_total_time_sec[merged_ts],
+                if pr['merged_at'] and ci_run['jobs']:
+                    merged = stats.slot(pr['merged_at'])
+                    job_secs = [ci_job['total_sec']
+                                for ci_job in ci_run['jobs']]
+                    run_sec = sum(job_secs)
+                    stats.ci_total_time_sec[merged] += run_sec
+                    if debug:
+                        debug_msg_github('ci_total_time_sec',
+                                         stats.ci_total_time_sec[merged],
+                                         'run', pr, comment, None,
+                                         str(run_sec) + 's')
+
+                    # this could end up being the longest job across
+                    # multiple changes if two changes merge at the same
+                    # time (to the microsecond), so not going to worry
+                    # about that for now but log what we're doing so
+                    # someone can debug this in future
+                    longest_sec = max(job_secs)
+                    if longest_sec > stats.ci_longest_time_sec[merged]:
+                        stats.ci_longest_time_sec[merged] = longest_sec
+                        if debug:
+                            ci_job = ci_run['jobs'][
+                                job_secs.index(longest_sec)]
+                            debug_msg_github('ci_longest_time_sec',
+                                             longest_sec,
                                              'job', pr, comment,
                                              ci_job['name'],
-                                             str(ci_job['total_sec']) + 's'))  # noqa
+                                             str(longest_sec) + 's')
 
-                        # this could end up being the longest job across
-                        # multiple changes if two changes merge at the same
-                        # time (to the microsecond), so not going to worry
-                        # about that for now but log what we're doing so
-                        # someone can debug this in future
-                        if (ci_job['total_sec'] >
-                                ci_longest_time_sec[merged_ts]):
-                            ci_longest_time_sec[merged_ts] = ci_job[
-                                'total_sec']
-                            log.debug(
-                                debug_msg_github('ci_longest_time_sec',
-                                                 ci_longest_time_sec[merged_ts],  # noqa
-                                                 'job', pr, comment,
-                                                 ci_job['name'],
-                                                 str(ci_job['total_sec']) + 's'))  # noqa
-
-    d = {'ci_total_time_sec': ci_total_time_sec,
-         'ci_longest_time_sec': ci_longest_time_sec,
-         'ci_success': ci_success,
-         'ci_failure': ci_failure,
-         'promotion_success': promotion_success,
-         'promotion_failure': promotion_failure}
-
-    df = pd.DataFrame(d, columns=['ci_total_time_sec', 'ci_longest_time_sec',
-                                  'ci_success', 'ci_failure',
-                                  'promotion_success', 'promotion_failure'])
+    df = stats.dataframe()
     log.debug('ci time status df:\n%s', df)
     return df
 
 
 def debug_msg_gerrit(field, counter, job_or_run, change, revision, name,
                      value):
-    return debug_msg(field, counter, job_or_run, change.project,
-                     change.number, revision.number, name, value)
+    debug_msg(field, counter, job_or_run, change.project, change.number,
+              revision.number, name, value)
 
 
 def debug_msg_github(field, counter, job_or_run, pr, comment,
                      ci_name, ci_val):
-    return debug_msg(field, counter, job_or_run,
-                     pr['base']['repo']['full_name'], pr['id'], comment['id'],
-                     ci_name, ci_val)
+    debug_msg(field, counter, job_or_run, pr['base']['repo']['full_name'],
+              pr['id'], comment['id'], ci_name, ci_val)
 
 
 def debug_msg(field, counter, job_or_run, project_name, change_id, message_id,
               ci_name, ci_val):
-    msg = '%s updated to %d with proj|change|rev|%s: %s|%s|%s|%s and %s' % (
-        field,
-        counter,
-        job_or_run,
-        project_name,
-        change_id,
-        message_id,
-        ci_name,
-        ci_val)
-    return msg
+    # leave the formatting to logging, so it only happens if the message is
+    # actually emitted
+    log.debug('%s updated to %d with proj|change|rev|%s: %s|%s|%s|%s and %s',
+              field, counter, job_or_run, project_name, change_id, message_id,
+              ci_name, ci_val)
 
 
-def generate_html(args, df, num_changes, start_dt, finish_dt,
-                  projects, projects_map,
-                  not_found_proj, group=None, groups=[]):
+def get_projects_to_report(args, df, projects, group):
     """
-    Returns html report from a dataframe for a specific project
+    Returns the projects a group's report covers, those of projects with a
+    dataframe in df
     """
     log.debug('Generating %s report for %s', args.report_format, group)
     log.debug(projects)
@@ -932,28 +1134,33 @@ def generate_html(args, df, num_changes, start_dt, finish_dt,
     else:
         projects_to_report = projects
 
-    frames = list()
     for project in projects_to_report:
         log.debug('%s df:\n%s', project, df[project])
-        frames.append(df[project])
+    return projects_to_report
+
+
+def generate_html(args, df, num_changes, start_dt, finish_dt,
+                  projects, projects_map,
+                  not_found_proj, group=None, groups=[], plot_frames=None,
+                  plotlyjs_version=None):
+    """
+    Returns html report from a dataframe for a specific project, as a
+    jinja2 TemplateStream so it can be rendered straight into the file
+    """
+    projects_to_report = get_projects_to_report(args, df, projects, group)
 
     # TODO wrap this in proper html or a template
-    if len(frames) <= 0:
+    if len(projects_to_report) <= 0:
         return 'No projects in this group'
-    df_plot = generate_plot(args, df, frames, start_dt)
+    df_plot = generate_plot(args, df, projects_to_report, start_dt,
+                            plot_frames)
 
-    # add a custom filter to jinja for url encoding
-    environment = jinja2.Environment()
-    environment.filters['quote_plus'] = lambda u: urllib.quote_plus(u)
-
-    with open(args.html_template, 'r') as f:
-        html_template = f.read()
-    template = environment.from_string(html_template)
+    template = get_html_template(args.html_template)
     if args.range_hours <= 24:
         title_units = '%d hours' % args.range_hours
     else:
         title_units = '%g days' % (args.range_hours / 24)
-    html = template.render(
+    html = template.stream(
         title='%s for last %s' % (args.report_title, title_units),
         group_list=groups,
         current_group=group,
@@ -970,68 +1177,119 @@ def generate_html(args, df, num_changes, start_dt, finish_dt,
         status_plot=plot_ci_success_failure(df_plot, group),
         projects_map=projects_map,
         not_found_proj=not_found_proj,
+        plotlyjs_version=plotlyjs_version or get_plotlyjs_version(),
         zs_ver=pkg_resources.get_distribution('zingstats').version)
     return html
 
 
+def get_plotlyjs_version():
+    """
+    Returns the version of the plotly.js bundled with the installed plotly,
+    read from the banner at the top of the bundle
+    """
+    match = PLOTLYJS_VERSION_RE.search(plotly.offline.get_plotlyjs()[:1024])
+    if match is None:
+        log.warning('No version found in the bundled plotly.js, the html '
+                    'reports will load the latest 1.x from the CDN')
+        return 'latest'
+    return match.group('version')
+
+
+def get_html_template(template_path):
+    """
+    Returns the compiled jinja2 template, the environment is created once per
+    template directory so a template is only compiled on first use
+    """
+    template_dir, template_name = os.path.split(
+        os.path.abspath(template_path))
+    environment = _template_environments.get(template_dir)
+    if environment is None:
+        # autoescape stays off, the plots are embedded as raw html
+        environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(template_dir),
+            bytecode_cache=jinja2.FileSystemBytecodeCache())
+        # add a custom filter to jinja for url encoding
+        environment.filters['quote_plus'] = lambda u: urllib.quote_plus(u)
+        _template_environments[template_dir] = environment
+    return environment.get_template(template_name)
+
+
 def generate_json(args, df, num_changes, start_dt, finish_dt,
                   projects, projects_map,
-                  not_found_proj, group=None, groups=[]):
+                  not_found_proj, group=None, groups=[], plot_frames=None):
     """
     Returns json report from a dataframe for a specific project
     """
-    log.debug('Generating %s report for %s', args.report_format, group)
-    log.debug(projects)
-
-    if group:
-        # we want to report on the projects that are common to projects and df
-        projects_to_report = list(set(projects).intersection(df))
-    else:
-        projects_to_report = projects
-
-    frames = list()
-    for project in projects_to_report:
-        log.debug('%s df:\n%s', project, df[project])
-        frames.append(df[project])
+    projects_to_report = get_projects_to_report(args, df, projects, group)
 
     # TODO wrap this in proper html or a template
-    if len(frames) <= 0:
+    if len(projects_to_report) <= 0:
         return 'No projects in this group'
-    df_plot = generate_plot(args, df, frames, start_dt)
+    df_plot = generate_plot(args, df, projects_to_report, start_dt,
+                            plot_frames)
     return df_plot.to_json(orient='table')
 
 
-def generate_plot(args, df, frames, start_dt):
-    df['total'] = pd.concat(frames)
-    df['total'].sort_index(inplace=True)
+def generate_parquet(args, df, num_changes, start_dt, finish_dt,
+                     projects, projects_map,
+                     not_found_proj, group=None, groups=[], plot_frames=None):
+    """
+    Returns the report dataframe for a specific project, for writing as
+    parquet (needs pyarrow, see the parquet extra)
+    """
+    projects_to_report = get_projects_to_report(args, df, projects, group)
+
+    if len(projects_to_report) <= 0:
+        return pd.DataFrame()
+    return generate_plot(args, df, projects_to_report, start_dt, plot_frames)
+
+
+def generate_plot(args, df, projects, start_dt, plot_frames=None):
+    """
+    Returns the plot frame for projects and sets df['total'] to their
+    combined frame. plot_frames, if given, holds the (total, plot) frames
+    already built for one report run keyed by the set of projects, and the
+    frames built here are added to it.
+    """
+    key = frozenset(projects)
+    if plot_frames is not None and key in plot_frames:
+        df['total'], df_plot = plot_frames[key]
+        return df_plot
+
+    # each project frame is already sorted and has the same columns, a
+    # stable mergesort keeps ties in project order
+    df['total'] = pd.concat([df[project] for project in projects],
+                            sort=False)
+    df['total'].sort_index(inplace=True, kind='mergesort')
     log.debug('total df:\n%s', df['total'])
     resample_window = set_resample_window(args.range_hours)
     df_plot = df['total'][df['total'].index > start_dt]
-    df_plot = df_plot.resample(resample_window).agg(({
-        'created': 'sum',
-        'merged': 'sum',
-        'updated': 'sum',
-        'ci_total_time_sec': 'sum',
-        'ci_longest_time_sec': 'max',
-        'ci_success': 'sum',
-        'ci_failure': 'sum',
-        'promotion_success': 'sum',
-        'promotion_failure': 'sum',
-        'lifespan_sec': 'max',
-        'recheck': 'sum',
-        'reverify': 'sum',
-        'revisions': 'mean',
-    })).fillna(0)
-    df_plot['pct_success'] = (df_plot['ci_success'] /
-                              (df_plot['ci_failure'] +
-                               df_plot['ci_success'])) * 100
-    df_plot['pct_failure'] = (df_plot['ci_failure'] /
-                              (df_plot['ci_failure'] +
-                               df_plot['ci_success'])) * 100
+    # group on the floored timestamps and only then fill in the empty
+    # buckets, rather than having resample lay out and aggregate every
+    # bucket of a mostly sparse range
+    buckets = df_plot.index.floor(resample_window)
+    grouped = df_plot.groupby(buckets)
+    df_plot = pd.concat(
+        [grouped[PLOT_SUM_COLUMNS].sum(),
+         grouped[PLOT_MAX_COLUMNS].max(),
+         grouped[PLOT_MEAN_COLUMNS].mean()], axis=1)[PLOT_COLUMNS]
+    if len(buckets):
+        df_plot = df_plot.reindex(pd.date_range(buckets[0], buckets[-1],
+                                                freq=resample_window),
+                                  fill_value=0)
+    # buckets without any CI runs get 0% rather than a NaN to fill later
+    ci_runs = (df_plot['ci_failure'] + df_plot['ci_success']).values
+    ran = ci_runs != 0
+    for column in ('success', 'failure'):
+        pct = np.zeros(len(ci_runs), dtype=np.float64)
+        np.divide(df_plot['ci_' + column].values, ci_runs, out=pct,
+                  where=ran)
+        df_plot['pct_' + column] = pct * 100
     df_plot['ci_total_time_min'] = df_plot['ci_total_time_sec'] / 60
     df_plot['ci_longest_time_min'] = df_plot['ci_longest_time_sec'] / 60
-    df_plot.fillna(value=0, inplace=True)
     log.debug('df plot= %s', df_plot)
+    if plot_frames is not None:
+        plot_frames[key] = (df['total'], df_plot)
     return df_plot
 
 
@@ -1049,12 +1307,10 @@ def plot_ci_success_failure(df_plot, group):
     # https://plot.ly/python/filled-area-plots/#stacked-area-chart-with-cumulative-values
     # Add data to create cumulative stacked values
     y0_stck = df_plot['pct_success']
-    y1_stck = [y0 + y1 for y0, y1 in
-               zip(df_plot['pct_success'],
-                   df_plot['pct_failure'])]
+    y1_stck = df_plot['pct_success'] + df_plot['pct_failure']
     # Make original values strings and add % for hover text
-    y0_txt = [str(y0) + '%' for y0 in df_plot['pct_success']]
-    y1_txt = [str(y1) + '%' for y1 in df_plot['pct_failure']]
+    y0_txt = df_plot['pct_success'].astype(str) + '%'
+    y1_txt = df_plot['pct_failure'].astype(str) + '%'
     ci_success_line = go.Scatter(
         name='Success',
         x=df_plot.index,
@@ -1092,23 +1348,25 @@ def plot_ci_success_failure(df_plot, group):
         },
         show_link=False,
         output_type='div',
-        include_plotlyjs='False')
+        include_plotlyjs=False,
+        validate=False)
     return status_plot
 
 
 def plot_ci_job_time(args, df_plot, group):
+    x_min, x_max = df_plot.index.min(), df_plot.index.max()
     ci_job_recommended_max_line = {
         'type': 'line',
-        'x0': df_plot.index.min(),
+        'x0': x_min,
         'y0': args.ci_job_recommended_max_minutes,
-        'x1': df_plot.index.max(),
+        'x1': x_max,
         'y1': args.ci_job_recommended_max_minutes,
         'line': {
             'color': 'rgb(230, 126, 34)',
             'width': 2,
             'dash': 'dot'}}
     ci_job_recommended_max_label = go.Scatter(
-        x=[df_plot.index.min() + timedelta(days=1)],
+        x=[x_min + timedelta(days=1)],
         y=[args.ci_job_recommended_max_minutes +
            (args.ci_job_recommended_max_minutes * 0.05)],
         mode='text',
@@ -1135,24 +1393,26 @@ def plot_ci_job_time(args, df_plot, group):
         },
         show_link=False,
         output_type='div',
-        include_plotlyjs='False')
+        include_plotlyjs=False,
+        validate=False)
     return ci_job_time_plot
 
 
 def plot_ci_capacity(args, df_plot, group):
     system_capacity_max_ci_minutes = args.system_capacity_daily_ci_hours * 24
+    x_min, x_max = df_plot.index.min(), df_plot.index.max()
     ci_75pct_capacity_line = {
         'type': 'line',
-        'x0': df_plot.index.min(),
+        'x0': x_min,
         'y0': system_capacity_max_ci_minutes,
-        'x1': df_plot.index.max(),
+        'x1': x_max,
         'y1': system_capacity_max_ci_minutes,
         'line': {
             'color': 'rgb(231, 76, 60)',
             'width': 2,
             'dash': 'dot'}}
     ci_75pct_capacity_line_label = go.Scatter(
-        x=[df_plot.index.min() + timedelta(days=1)],
+        x=[x_min + timedelta(days=1)],
         y=[system_capacity_max_ci_minutes +
            (system_capacity_max_ci_minutes * 0.05)],
         mode='text',
@@ -1176,7 +1436,8 @@ def plot_ci_capacity(args, df_plot, group):
         },
         show_link=False,
         output_type='div',
-        include_plotlyjs='False')
+        include_plotlyjs=False,
+        validate=False)
     return ci_capacity_plot
 
 
@@ -1201,7 +1462,8 @@ def plot_changes(df_plot, group):
         },
         show_link=False,
         output_type='div',
-        include_plotlyjs='False')
+        include_plotlyjs=False,
+        validate=False)
     return changes_plot
 
 